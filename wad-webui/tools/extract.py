@@ -12,7 +12,9 @@ League of Legends *.wad.client* extractor
 """
 
 from __future__ import annotations
-import os, struct, pathlib, zstandard as zstd, xxhash, json
+import os, sys, mmap, struct, pathlib, threading, functools, contextlib, zstandard as zstd, xxhash, json
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 # ── configuration ──────────────────────────────────────────────────────────
 HASH_TABLE_PATHS = [
@@ -25,19 +27,93 @@ ENTRY_SIZE     = 16
 MAX_CHUNKS     = 50_000
 ZSTD_MAGIC     = b"\x28\xB5\x2F\xFD"
 MANIFEST_HASH  = 0x0000000300000180  # chunk that stores pathHashes[]
+LOG_BATCH      = 256            # progress lines per stdout write
+
+# precompiled record layouts
+_ENTRY         = struct.Struct("<QII")   # chunk table: hash, offset, size
+_U32           = struct.Struct("<I")
+_PATH_HEADER   = struct.Struct("<QI")    # manifest: hash, string length
+
+# one decompression context per worker thread; building a fresh
+# ZstdDecompressor per chunk re-allocates the zstd DCtx every time, and a
+# single shared one is not safe for concurrent use
+_TLS = threading.local()
+_STREAM_STEP = 1 << 17           # compressed bytes fed per decompressobj() call
 
 # ── helpers ───────────────────────────────────────────────────────────────
-def _maybe_decompress(data: bytes) -> bytes:
-    return zstd.ZstdDecompressor().decompress(data) if data.startswith(ZSTD_MAGIC) else data
+def _dctx() -> zstd.ZstdDecompressor:
+    dctx = getattr(_TLS, "dctx", None)
+    if dctx is None:
+        dctx = _TLS.dctx = zstd.ZstdDecompressor()
+    return dctx
+
+def _scratch() -> bytearray:
+    buf = getattr(_TLS, "buf", None)
+    if buf is None:
+        buf = _TLS.buf = bytearray(1 << 20)
+    return buf
+
+# owned copy for callers outside the worker pool (the manifest); the
+# scratch buffer is dropped so this thread doesn't keep it for the process
+def _maybe_decompress(data: memoryview) -> bytes:
+    if data[:4] != ZSTD_MAGIC:
+        return bytes(data)
+    out = bytes(_decompress(data))
+    vars(_TLS).pop("buf", None)
+    return out
+
+# the result may be a view of this thread's scratch buffer, valid until the
+# thread's next _decompress call; workers write it out before returning
+def _decompress(data: memoryview) -> bytes | memoryview:
+    dctx = _dctx()
+    if zstd.frame_content_size(data) >= 0:
+        return dctx.decompress(data)     # header gives the exact output size
+    # size unknown: stream into this thread's scratch buffer, which keeps
+    # the size of the largest chunk seen instead of regrowing per chunk
+    buf, n = _scratch(), 0
+    dobj   = dctx.decompressobj()
+    for pos in range(0, len(data), _STREAM_STEP):
+        out = dobj.decompress(data[pos:pos + _STREAM_STEP])
+        end = n + len(out)
+        if end > len(buf):               # grow by copy: old views may linger
+            grown = bytearray(max(2 * len(buf), end))
+            grown[:n] = memoryview(buf)[:n]
+            buf = _TLS.buf = grown
+        buf[n:end] = out
+        n = end
+        if dobj.eof:
+            break
+    if not dobj.eof:                     # input ran out before the frame ended
+        raise zstd.ZstdError("decompression error: truncated frame of unknown size")
+    return memoryview(buf)[:n]
+
+# magic → extension, grouped by prefix length (longest first) so a guess is
+# one dict lookup per length
+_MAGIC: tuple[tuple[int, dict[bytes, str]], ...] = (
+    (8, {
+        b"r3d2Mesh": "scb",
+        b"r3d2sklt": "skl",
+        b"r3d2anmd": "anm",
+        b"r3d2canm": "anm",
+    }),
+    (7, {
+        b"PreLoad":  "preload",
+    }),
+    (4, {
+        b"DDS ":     "dds",
+        b"\x89PNG":  "png",
+        b"PROP":     "bin",
+        b"SKN\x00":  "skn",
+        b"SKL\x00":  "skl",
+        b"[Obj":     "sco",
+    }),
+)
 
 def _guess_ext(data: bytes) -> str:
-    if data.startswith(b"DDS "):      return "dds"
-    if data.startswith(b"\x89PNG"):   return "png"
-    if data.startswith(b"PROP"):      return "bin"
-    if data[:8] in (b"SKN\x00", b"SKL\x00"):
-        return "skn" if data[:4] == b"SKN\x00" else "skl"
-    if data.startswith(b"r3d2Mesh"):  return "scb"
-    if data.startswith(b"[Obj"):      return "sco"
+    for n, table in _MAGIC:
+        ext = table.get(data[:n])
+        if ext:
+            return ext
     return "bin"
 
 def _load_hash_table(paths: list[str]) -> dict[int, str]:
@@ -45,12 +121,25 @@ def _load_hash_table(paths: list[str]) -> dict[int, str]:
     for p in paths:
         if not os.path.exists(p):
             continue
-        with open(p, encoding="utf-8") as fp:
+        # stream in binary: the hash is parsed straight from bytes and only
+        # the retained name is ever decoded
+        with open(p, "rb") as fp:
             for line in fp:
-                h, name = line.strip().split(" ", 1)
-                mapping[int(h, 16)] = name
+                h, sep, name = line.rstrip().partition(b" ")
+                if sep:                      # skip blank/malformed lines
+                    mapping[int(h, 16)] = name.decode("utf-8", "replace")
     return mapping
 
+# the static tables are the same for every WAD: parse them once per process
+# (an empty result isn't cached, so tables that appear later are picked up)
+_HASH_TABLE: dict[int, str] | None = None
+
+def _get_hash_table() -> dict[int, str]:
+    global _HASH_TABLE
+    if not _HASH_TABLE:
+        _HASH_TABLE = _load_hash_table(HASH_TABLE_PATHS) or None
+    return _HASH_TABLE or {}
+
 # ── manifest decoder (exact layout) ───────────────────────────────────────
 def _parse_manifest(chunk: bytes) -> dict[int, str]:
     MAGIC = b"pathHashes\x00"
@@ -60,65 +149,168 @@ def _parse_manifest(chunk: bytes) -> dict[int, str]:
     pos  += len(MAGIC)
     pos   = (pos + 3) & ~3           # 4-byte align
     pos  += 4                        # skip flags/padding
-    count, = struct.unpack_from("<I", chunk, pos)
+    count, = _U32.unpack_from(chunk, pos)
     pos  += 4
 
     out: dict[int, str] = {}
     for _ in range(count):
-        h, strlen = struct.unpack_from("<QI", chunk, pos)
+        h, strlen = _PATH_HEADER.unpack_from(chunk, pos)
         pos += 12
         s   = chunk[pos : pos + strlen].decode("utf-8", "replace")
         pos += strlen
         out[h] = s
     return out
 
+# UTF-8 length without encoding in the common all-ASCII case
+def _u8len(s: str) -> int:
+    return len(s) if s.isascii() else len(s.encode())
+
 # truncate any *single* path component that would blow past 120 bytes
+# (cached: the same directory names recur across thousands of chunks)
+@functools.lru_cache(maxsize=None)
 def _safe_component(comp: str, max_len: int = 120) -> str:
-    if len(comp.encode()) <= max_len:
+    if _u8len(comp) <= max_len:
         return comp
     # keep extension, keep first half, add hash tag
     base, ext = os.path.splitext(comp)
-    tag       = xxhash.xxh32(comp).hexdigest()
+    tag       = f"{xxhash.xxh3_64_intdigest(comp.encode()):016x}"
     return f"{base[:max_len//2]}_{tag}{ext}"
 
+# raw fd write: skips the BufferedWriter that Path.write_bytes sets up per file
+_O_WRITE = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _write_file(path: pathlib.Path, data: bytes | memoryview) -> None:
+    fd = os.open(path, _O_WRITE, 0o666)
+    try:
+        view = memoryview(data)
+        while view:                  # os.write may return a short count
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+# Linux copies file ranges kernel-side; elsewhere (macOS sendfile only
+# targets sockets) stored chunks are written from the mapped view instead
+_SENDFILE = sys.platform.startswith("linux")
+
+def _copy_range(path: pathlib.Path, src_fd: int, offset: int, size: int) -> None:
+    fd = os.open(path, _O_WRITE, 0o666)
+    try:
+        while size:
+            sent = os.sendfile(fd, src_fd, offset, size)
+            if not sent:
+                raise EOFError(f"WAD ended inside chunk at offset {offset:#x}")
+            offset += sent
+            size   -= sent
+    finally:
+        os.close(fd)
+
+# one stdout write per batch instead of a (TTY-flushed) print per chunk
+def _flush_log(lines: list[str]) -> None:
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        lines.clear()
+
+# read-only view of an open file; mmap rejects empty files
+@contextlib.contextmanager
+def _map_readonly(fp) -> Iterator[memoryview]:
+    mm   = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    try:
+        yield view
+    except BaseException:
+        # frames of the in-flight traceback may still pin slices of the map;
+        # leave the unmap to the GC so the original error propagates instead
+        # of a BufferError from close()
+        with contextlib.suppress(BufferError):
+            view.release()
+            mm.close()
+        raise
+    view.release()
+    mm.close()
+
 # ── main extractor ────────────────────────────────────────────────────────
 def extract_wad(wad_path: pathlib.Path, out_root: pathlib.Path) -> None:
-    wad_bytes = wad_path.read_bytes()
-    wad_size  = len(wad_bytes)
-
-    # 1) hash → payload (later duplicate overrides earlier)
-    chunks: dict[int, bytes] = {}
-    for n in range(MAX_CHUNKS):
-        off = TABLE_OFFSET + n * ENTRY_SIZE
-        if off + ENTRY_SIZE > wad_size:
-            break
-        h, loc, size = struct.unpack_from("<QII", wad_bytes, off)
-        if not any((h, loc, size)):
-            break                    # zero entry marks end of table
-        if size == 0 or loc + size > wad_size:
-            continue                 # corrupt/span-out-of-file
-        chunks[h] = _maybe_decompress(wad_bytes[loc:loc+size])
-
-    # 2) build hash → name map (static list + per-file manifest)
-    names = _load_hash_table(HASH_TABLE_PATHS)
-    if MANIFEST_HASH in chunks:
-        names.update(_parse_manifest(chunks[MANIFEST_HASH]))
-
-    # 3) write assets
-    out_dir = out_root / wad_path.stem
-    for h, data in chunks.items():
-        ext      = _guess_ext(data)
-        rel_path = names.get(h, f"{h:016x}.{ext}")
-        rel_path = "/".join(_safe_component(p) for p in rel_path.split("/"))
-
-        dest = out_dir / rel_path
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        dest.write_bytes(data)
-        print(f"[✓] {dest.relative_to(out_root)}  {len(data):,} B")
+    wad_size = wad_path.stat().st_size
+    if wad_size < TABLE_OFFSET + ENTRY_SIZE:
+        return                       # no chunk table (mmap rejects empty files)
+
+    # 1) hash → (offset, size) (later duplicate overrides earlier); the WAD
+    #    is mapped, so payloads reach the decompressor without a heap copy
+    with open(wad_path, "rb") as fp, _map_readonly(fp) as view:
+        entries: dict[int, tuple[int, int]] = {}
+        n_max = min(MAX_CHUNKS, (wad_size - TABLE_OFFSET) // ENTRY_SIZE)
+        table_end = TABLE_OFFSET + n_max * ENTRY_SIZE
+        for h, loc, size in _ENTRY.iter_unpack(view[TABLE_OFFSET:table_end]):
+            if not (h or loc or size):
+                break                # zero entry marks end of table
+            if size == 0 or loc + size > wad_size:
+                continue             # corrupt/span-out-of-file
+            entries[h] = (loc, size)
+
+        # 2) hash → name maps (per-file manifest first, then the shared
+        #    static list, which must not be mutated); the manifest is decoded
+        #    up front so every other chunk can be written as soon as it is
+        manifest = {}
+        if MANIFEST_HASH in entries:
+            loc, size = entries[MANIFEST_HASH]
+            manifest  = _parse_manifest(_maybe_decompress(view[loc:loc+size]))
+        # the static tables are only loaded if the manifest leaves gaps (the
+        # manifest chunk never lists its own hash, so it doesn't count)
+        unnamed = entries.keys() - manifest.keys() - {MANIFEST_HASH}
+        names   = _get_hash_table() if unnamed else {}
+
+        # 3) resolve every known name now and create each parent directory
+        #    exactly once; unnamed chunks land in out_dir as <hash>.<ext>
+        out_dir = out_root / wad_path.stem
+        rel_paths: dict[int, str] = {}
+        for h in entries:
+            name = manifest.get(h) or names.get(h)
+            if name is not None:
+                rel_paths[h] = "/".join([_safe_component(p) for p in name.split("/")])
+        parents = {(out_dir / r).parent for r in rel_paths.values()}
+        if len(rel_paths) < len(entries):
+            parents.add(out_dir)
+        for parent in parents:
+            parent.mkdir(parents=True, exist_ok=True)
+
+        # 4) decompress + write; chunks are independent, and both zstd and
+        #    the write syscalls release the GIL
+        #    stored (uncompressed) chunks are never copied into Python:
+        #    they go out via sendfile or straight from the mapped view
+        def _extract(h: int) -> tuple[pathlib.Path, int]:
+            loc, size = entries[h]
+            data     = view[loc:loc+size]
+            stored   = data[:4] != ZSTD_MAGIC
+            if not stored:
+                data = _decompress(data)
+            rel_path = rel_paths.get(h)
+            if rel_path is None:     # only unnamed chunks need their magic sniffed
+                rel_path = f"{h:016x}.{_guess_ext(bytes(data[:8]))}"
+
+            dest = out_dir / rel_path
+            if stored and _SENDFILE:
+                _copy_range(dest, fp.fileno(), loc, size)
+            else:
+                _write_file(dest, data)
+            return dest, len(data)
+
+        # visit payloads in file order so reads through the map stay
+        # sequential and the OS read-ahead stays useful; workers only hold
+        # one payload each, so queueing every chunk up front is cheap
+        ordered = sorted(entries, key=lambda h: entries[h][0])
+        log: list[str] = []
+        log_append = log.append
+        try:
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                for dest, n in pool.map(_extract, ordered):
+                    log_append(f"[✓] {dest.relative_to(out_root)}  {n:,} B")
+                    if len(log) >= LOG_BATCH:
+                        _flush_log(log)
+        finally:
+            _flush_log(log)      # report files already written, even on error
 
 # ── simple CLI ────────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) != 2:
         raise SystemExit("usage: extract.py <file.wad.client>")
     extract_wad(pathlib.Path(sys.argv[1]), pathlib.Path(OUTPUT_DIR))